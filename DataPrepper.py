@@ -1,12 +1,68 @@
 # Import standard modules
+import os
 import sys
 import pickle
-from math import log
+import hashlib
+import tempfile
 from math import pow
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from scipy.sparse import csr_matrix
 
 # Import necessary modules
+import porter
 from Tokenizer import Tokenizer
 
+# Feature vectors store one float32 per non-zero entry, half the size of float64
+FEATURE_DTYPE = np.float32
+
+# Directory holding pickled count_vocab results from previous training runs,
+# kept next to this module regardless of the working directory
+PATH_TO_CACHE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+
+# Source files whose code determines the cached count_vocab results (reading,
+# tokenizing and counting docs, and the layout and dtype of what is pickled),
+# part of the cache key
+CACHE_KEY_SOURCES = [__file__, sys.modules[Tokenizer.__module__].__file__, porter.__file__]
+
+#===========================================================================#
+# PARALLEL TOKENIZATION
+# Module-level so that they can be pickled into worker processes
+#===========================================================================#
+worker_tokenizer = None
+
+def init_tokenizer_worker(tokenizer):
+  global worker_tokenizer
+  worker_tokenizer = tokenizer
+
+"""
+Reads a whole doc with a single binary read and decodes it in one shot
+"""
+def read_text(path_to_doc):
+  with open(path_to_doc, 'rb') as f:
+    return f.read().decode('latin1')
+
+"""
+Reads and tokenizes a single [doc_name, path_to_doc, class_name] entry
+
+Returns (doc_name, class_name, Counter({'token1': tf1, 'token2': tf2, ...}))
+"""
+def read_and_count_terms(fpc):
+  tokens = worker_tokenizer.tokenize(read_text(fpc[1]))
+  return (fpc[0], fpc[2], Counter(tokens))
+
+"""
+Wraps CSR triples accumulated in typed arrays, data as array('f') and
+indices and indptr as array('i'), in a sparse CSR matrix. The arrays'
+buffers are viewed by NumPy as they are, without copying or unboxing
+"""
+def to_csr_matrix(data, indices, indptr, shape):
+  return csr_matrix((np.frombuffer(data, dtype=FEATURE_DTYPE),
+                     np.frombuffer(indices, dtype=np.int32),
+                     np.frombuffer(indptr, dtype=np.int32)), shape=shape)
+
 #===========================================================================#
 # PREPARING THE DATASET FOR TEXT CLASSIFICATION
 # Executes the text normalization phase
@@ -26,6 +82,7 @@ class DataPrepper():
       # F.P.C means filename_path_classnames
       self.fpc = self.load_paths_to_training_text()
       self.total_num_classes = len(self.fpc)
+      self.class_to_fpc = self.group_fpc_by_class()
       self.class_counts = self.get_class_counts()
       self.class_names = list(self.class_counts.keys())
 
@@ -33,32 +90,37 @@ class DataPrepper():
 
   """
   Processes the dataset and returns their feature vectors in the format:
-    [[feature_vector, 'c1'], [feature_vector, 'c2'] ...]
+    [X, ['c1', 'c2', ...], doc_freq]
+  where row i of the sparse CSR matrix X is the feature vector of the doc
+  labelled with the i-th class name
   """
   def run(self):
     print("[DataPrepper] Running on training set...")
-    print("[DataPrepper] Sampling texts from disk...")
-    dataset = self.sample_texts()
-
-    print("[DataPrepper] Tokenizing...")
-    doc_df_pair = self.tokenize_dataset(dataset)
-    docs = doc_df_pair[0]
-    doc_freq = doc_df_pair[1]
-    doc_freq = self.cull_doc_freq(doc_freq, 5, len(doc_freq.keys()))
+    counts_vocab_classes_df = self.load_or_count_vocab()
+    X_counts = counts_vocab_classes_df[0]
+    vocab_idx = counts_vocab_classes_df[1]
+    class_names = counts_vocab_classes_df[2]
+    doc_freq = counts_vocab_classes_df[3]
+    doc_freq = self.cull_doc_freq(doc_freq, 5, len(doc_freq))
     doc_freq = self.cull_low_chisq_doc_freq(doc_freq, 4)
-    print("Number of words in vocab:", len(doc_freq.keys()))
+    print("Number of words in vocab:", len(doc_freq))
     print("[DataPrepper] Setting up feature vectors...")
-    feature_vectors_class = self.setup_tfidf_vectors(docs, doc_freq)
 
-    return [feature_vectors_class, doc_freq]
+    # Keep only the columns of the culled vocab, in doc_freq's order
+    X_counts = X_counts[:, [vocab_idx[token] for token in doc_freq]]
+    df_array = np.fromiter((doc_freq[token]['count'] for token in doc_freq), dtype=np.int64, count=len(doc_freq))
+    X = self.apply_tfidf_weights(X_counts, df_array)
+
+    return [X, class_names, doc_freq]
 
   def run_test(self, doc_freq):
     print("[DataPrepper] Running on testset...")
+    # The trained vocab is already culled, so index it before touching any doc.
+    # Keys are interned like the Tokenizer's tokens so lookups match by identity
+    token_to_idx = {sys.intern(token): i for i, token in enumerate(doc_freq)}
+
     dataset_filepath = self.sample_texts_for_test()
-    doc_df_pair = self.tokenize_dataset_for_test(dataset_filepath)
-    docs = doc_df_pair[0]
-    doc_freq_testset = doc_df_pair[1]
-    f_vectors_filepath = self.setup_tfidf_vectors(docs, doc_freq, doc_freq_map_testset=doc_freq_testset, test_mode=True)
+    f_vectors_filepath = self.setup_tfidf_vectors_for_test(dataset_filepath, token_to_idx)
 
     return f_vectors_filepath
 
@@ -68,113 +130,179 @@ class DataPrepper():
   #
   # ALSO CONSTRUCTS VOCABULARY / DOC FREQ MAP ON-THE-FLY
   #===========================================================================#
-  def tokenize_dataset(self, dict_class_documents):
+  """
+  Builds a sparse CSR matrix of raw term counts from docs, an iterable of
+  (doc_name, class_name, term_counts), while constructing the vocab and doc
+  freq map. N_DOCS is the number of docs in docs, used for the progress bar.
+
+  Returns [X_counts, vocab_idx, [class_name1, class_name2, ...], doc_freq_map]
+  where vocab_idx maps every token to its column in X_counts
+  """
+  def count_vocab(self, docs, N_DOCS):
     doc_freq_map = {}
-    class_df_map = {}
-    docs = dict_class_documents.keys()
-    N_DOCS = len(docs)
+    vocab_idx = {}
+    class_names = []
+    data = array('f')
+    indices = array('i')
+    indptr = array('i', [0])
 
     self.print_loading_bar(0, N_DOCS, progress_text='Tokenizing: ', complete_text='Complete')
-    for i, doc_name in enumerate(docs):
-      dict_class_documents[doc_name][0] = self.Tokenizer.tokenize(dict_class_documents[doc_name][0])
-      class_name = dict_class_documents[doc_name][1]
-
-      # Construct doc freq map on-the-fly
-      tokens_processed_before = {}
-      for token in dict_class_documents[doc_name][0]:
-        if not tokens_processed_before.get(token): # unique tokens in a doc
-          tokens_processed_before[token] = True # processed before, so mark as True
-          if not doc_freq_map.get(token): # if token is newly found, initialize
-            # Initialize token's doc freqs
-            doc_freq_map[token] = {
-              'count': 1,
-              'class-specific': {}
-            }
-
-            # Initialize class-specific doc freq
-            for c in self.class_names:
-              doc_freq_map[token]['class-specific'][c] = 0
-            doc_freq_map[token]['class-specific'][class_name] = 1
-
-          else:
-            doc_freq_map[token]['count'] += 1 # since the word appears in this doc
-            doc_freq_map[token]['class-specific'][class_name] += 1
-
-      self.print_loading_bar(i + 1, N_DOCS, progress_text='Tokenizing: ', complete_text='Complete')
+    for i, (doc_name, class_name, term_counts) in enumerate(docs):
+      # Keys of the counter are the unique tokens in this doc
+      for token, tf in term_counts.items():
+        idx = vocab_idx.get(token)
+        if idx is None: # if token is newly found, initialize
+          token = sys.intern(token)
+          idx = vocab_idx[token] = len(vocab_idx)
+
+          # Initialize token's doc freqs, class-specific doc freqs only hold
+          # the classes the token has appeared in
+          doc_freq_map[token] = {
+            'count': 1,
+            'class-specific': {class_name: 1}
+          }
 
-    return [dict_class_documents, doc_freq_map]
+        else:
+          token_df = doc_freq_map[token]
+          token_df['count'] += 1 # since the word appears in this doc
+          token_df['class-specific'][class_name] = token_df['class-specific'].get(class_name, 0) + 1
 
-  def tokenize_dataset_for_test(self, dict_class_documents):
-    doc_freq_map = {}
-    docs = dict_class_documents.keys()
-    N_DOCS = len(docs)
+        data.append(tf)
+        indices.append(idx)
 
-    self.print_loading_bar(0, N_DOCS, progress_text='Tokenizing: ', complete_text='Complete')
-    for i, doc_name in enumerate(docs):
-      dict_class_documents[doc_name][0] = self.Tokenizer.tokenize(dict_class_documents[doc_name][0])
-
-      # Construct doc freq map on-the-fly
-      tokens_processed_before = {}
-      for token in dict_class_documents[doc_name][0]:
-        if not tokens_processed_before.get(token): # unique tokens in a doc
-          tokens_processed_before[token] = True # processed before, so mark as True
-          if not doc_freq_map.get(token):   # if token is newly found, initialize
-            doc_freq_map[token] = 1
-          else:
-            doc_freq_map[token] += 1 # since the word appears in this doc
+      indptr.append(len(indices))
+      class_names.append(class_name)
 
       self.print_loading_bar(i + 1, N_DOCS, progress_text='Tokenizing: ', complete_text='Complete')
 
-    return [dict_class_documents, doc_freq_map]
+    X_counts = to_csr_matrix(data, indices, indptr, (len(class_names), len(vocab_idx)))
 
+    return [X_counts, vocab_idx, class_names, doc_freq_map]
+
+  """
+  Returns the result of count_vocab over the training docs, loading it from
+  a pickle in PATH_TO_CACHE if the docs, their classes and the stop words are
+  unchanged since it was saved. Otherwise reads, tokenizes and counts the
+  docs, then saves the result for the next run.
+  """
+  def load_or_count_vocab(self):
+    path_to_cache = os.path.join(PATH_TO_CACHE, self.get_cache_key() + '.pkl')
+
+    if os.path.exists(path_to_cache):
+      print("[DataPrepper] Loading tokenized texts from", path_to_cache)
+      # Anything that fails to load, e.g. a pickle written by other numpy or
+      # scipy versions, or that isn't count_vocab's 4-list is a cache miss
+      try:
+        with open(path_to_cache, 'rb') as f:
+          counts_vocab_classes_df = pickle.load(f)
+        if isinstance(counts_vocab_classes_df, list) and len(counts_vocab_classes_df) == 4:
+          return counts_vocab_classes_df
+      except Exception:
+        pass
+      print("[DataPrepper] Cache is unreadable, recounting...")
+
+    print("[DataPrepper] Reading and tokenizing texts from disk...")
+    counts_vocab_classes_df = self.count_vocab(self.iter_docs(), len(self.fpc))
+
+    # Write to a temp file first so an interrupted run never leaves a
+    # truncated pickle at path_to_cache
+    os.makedirs(PATH_TO_CACHE, exist_ok=True)
+    fd, path_to_tmp = tempfile.mkstemp(dir=PATH_TO_CACHE, suffix='.tmp')
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        pickle.dump(counts_vocab_classes_df, f, protocol=pickle.HIGHEST_PROTOCOL)
+      # mkstemp creates the file as 0600, give it the permissions open() would
+      umask = os.umask(0)
+      os.umask(umask)
+      os.chmod(path_to_tmp, 0o666 & ~umask)
+      os.replace(path_to_tmp, path_to_cache)
+    except BaseException:
+      os.remove(path_to_tmp)
+      raise
+
+    return counts_vocab_classes_df
+
+  """
+  Hashes every [doc_name, path_to_doc, class_name] entry in self.fpc with the
+  modification time of its doc, along with the stop word list's and the
+  source code of this module, the tokenizer and the stemmer, so that any
+  change to the corpus, to tokenization or to the cached format gives a
+  different key
+  """
+  def get_cache_key(self):
+    entries = [(fpc[0], fpc[1], fpc[2], os.path.getmtime(fpc[1])) for fpc in self.fpc]
+    stop_words = (self.PATH_TO_STOP_WORDS, os.path.getmtime(self.PATH_TO_STOP_WORDS))
+
+    key = hashlib.md5(repr((entries, stop_words)).encode())
+    for path_to_source in CACHE_KEY_SOURCES:
+      with open(path_to_source, 'rb') as f:
+        key.update(f.read())
+    return key.hexdigest()
 
   #===========================================================================#
   # TF-IDF VECTORIZATION
   # Compute TF-IDF vectors for every document
   #===========================================================================#
   """
-  Returns [[f_vector1, class_name], [f_vector2, class_name] ...].
-  class_name is path to text doc represented by feature vector if test_mode=True
+  Tokenizes the test docs and counts their terms in a single pass, keeping
+  only the tokens found in token_to_idx (the trained vocab), which maps each
+  of them to its column in X.
+
+  Returns [X, [path_to_doc1, path_to_doc2, ...]], where X is a sparse CSR
+  matrix whose i-th row is the feature vector of the doc at path_to_doc i
   """
-  def setup_tfidf_vectors(self, dict_class_documents, doc_freq_map, doc_freq_map_testset=None, test_mode=False):
-    vocab = list(doc_freq_map.keys())
-    doc_names = dict_class_documents.keys()
-    N_VOCAB = len(vocab)
-    N_DOCNAMES = len(doc_names)
-    f_vectors_classname = []
+  def setup_tfidf_vectors_for_test(self, dict_class_documents, token_to_idx):
+    N_VOCAB = len(token_to_idx)
+    N_DOCNAMES = len(dict_class_documents)
+    doc_freq_map = Counter()
 
-    self.print_loading_bar(0, N_DOCNAMES, progress_text='Setting up feature vectors:', complete_text='Complete')
-    for i, doc_name in enumerate(doc_names):
-      doc = dict_class_documents[doc_name][0]
-      class_name = dict_class_documents[doc_name][1]
-      f_vector = [0] * N_VOCAB
+    # CSR triples of raw term counts, only the non-zero entries of each doc are stored
+    data = array('f')
+    indices = array('i')
+    indptr = array('i', [0])
+    filepaths = []
 
-      for token in doc:
-        if doc_freq_map.get(token):
-          tf = doc.count(token)
-          log_tf = (1 + log(tf)) if tf > 0 else 0.0
+    self.print_loading_bar(0, N_DOCNAMES, progress_text='Setting up feature vectors:', complete_text='Complete')
+    for i, entry in enumerate(dict_class_documents.values()):
+      term_counts = Counter(token for token in self.Tokenizer.tokenize(entry[0]) if token in token_to_idx)
 
-          if test_mode and doc_freq_map_testset:
-            log_idf = log(N_DOCNAMES / doc_freq_map_testset[token])
-          else:
-            log_idf = log(N_DOCNAMES / doc_freq_map[token]['count'])
+      # Construct doc freq map on-the-fly, the keys of the counter are the
+      # unique tokens in this doc. Counter.update tallies them in C
+      doc_freq_map.update(term_counts.keys())
 
-          w = log_tf * log_idf
-          f_vector[vocab.index(token)] = w
+      for token, tf in term_counts.items():
+        data.append(tf)
+        indices.append(token_to_idx[token])
 
-      f_vectors_classname.append([f_vector, class_name])
+      indptr.append(len(indices))
+      filepaths.append(entry[1])
 
       self.print_loading_bar(i + 1, N_DOCNAMES, progress_text='Setting up feature vectors:', complete_text='Complete')
 
-    return f_vectors_classname
+    X = to_csr_matrix(data, indices, indptr, (N_DOCNAMES, N_VOCAB))
+
+    # IDF only depends on the vocab term, so compute it once per term. Terms
+    # missing from the testset never appear in X, so give them an idf of 0
+    doc_freqs = (doc_freq_map.get(token, N_DOCNAMES) for token in token_to_idx)
+    df_array = np.fromiter(doc_freqs, dtype=np.int64, count=N_VOCAB)
+
+    return [self.apply_tfidf_weights(X, df_array), filepaths]
+
+  """
+  Converts a CSR matrix of raw term counts into TF-IDF weights, where
+  df_array[j] is the doc freq of the vocab term in column j
+  """
+  def apply_tfidf_weights(self, X, df_array):
+    idf = np.log(X.shape[0] / df_array).astype(FEATURE_DTYPE)
+
+    # Log-scaled tf times idf, applied in place to all non-zero entries at once
+    np.log(X.data, out=X.data)
+    X.data += 1.0
+    X.data *= idf[X.indices]
+    return X
 
   def cull_doc_freq(self, doc_freq_map, low_num_docs, high_num_docs):
-    culled_df_map = {}
-    for word in doc_freq_map:
-      num_occurrences = doc_freq_map[word]['count']
-      if num_occurrences < high_num_docs and num_occurrences > low_num_docs:
-        culled_df_map[word] = doc_freq_map[word]
-    return culled_df_map
+    return {word: word_df for word, word_df in doc_freq_map.items() if low_num_docs < word_df['count'] < high_num_docs}
 
   def cull_low_chisq_doc_freq(self, doc_freq_map, min_chisq):
     print('Culling low chisq...')
@@ -195,9 +323,9 @@ class DataPrepper():
         # N01 is the number of training texts that do not contain w and are in class c.
         # N10 is the number of training texts that contain w and are not in class c.
         # N11 is the number of training texts that contain w and are in class c.
-        N_11 = doc_freq_map[token]['class-specific'][pos_class_name]
+        N_11 = doc_freq_map[token]['class-specific'].get(pos_class_name, 0)
         N_01 = N_docs_pos_c - N_11
-        N_10 = self.sum_neg_doc_freq(pos_class_name, doc_freq_map[token]['class-specific'])
+        N_10 = doc_freq_map[token]['count'] - N_11
         N_00 = N_docs_not_in_pos_c - N_10
 
         if  (N_11 > 0 and N_01 > 0) and \
@@ -221,13 +349,6 @@ class DataPrepper():
 
     return culled_df_map
 
-  def sum_neg_doc_freq(self, pos_class_name, token_df):
-    sum = 0
-    for c in token_df:
-      if not c == pos_class_name:
-        sum += token_df[c]
-    return sum
-
   #===========================================================================#
   # CONSTRUCT THE DATASET
   # Retrieves texts from training and test files
@@ -241,8 +362,8 @@ class DataPrepper():
     [[doc_name, path_to_doc, class_name], ...]
   """
   def load_paths_to_training_text(self):
-    filepath_class_file = open(self.PATH_TO_CLASS_LIST, 'r')
-    filepath_class_lines = filepath_class_file.readlines()
+    with open(self.PATH_TO_CLASS_LIST, 'r') as filepath_class_file:
+      filepath_class_lines = filepath_class_file.readlines()
 
     filename_path_classnames = []
     for ln in filepath_class_lines:
@@ -265,8 +386,8 @@ class DataPrepper():
     [[doc_name, path_to_doc], ...]
   """
   def load_paths_to_test_text(self):
-    filename_path = open(self.PATH_TO_CLASS_LIST, 'r')
-    filename_path_lines = filename_path.readlines()
+    with open(self.PATH_TO_CLASS_LIST, 'r') as filename_path:
+      filename_path_lines = filename_path.readlines()
 
     filename_paths = []
     for ln in filename_path_lines:
@@ -278,21 +399,25 @@ class DataPrepper():
     return filename_paths
 
   """
-  Gets counts of all docs in each class in our corpus
+  Groups the entries of self.fpc by class in a single pass
 
-  Returns a dictionary of class counts
+  Returns a dictionary in the format:
+    { 'c1': [[doc_name, path_to_doc, 'c1'], ...], ... }
   """
-  def get_class_counts(self):
+  def group_fpc_by_class(self):
     result = {}
     for filename_path_classname in self.fpc:
-      candidate_class_name = filename_path_classname[2]
-
-      if candidate_class_name not in result:
-        result[candidate_class_name] = 1
-      else:
-        result[candidate_class_name] += 1
+      result.setdefault(filename_path_classname[2], []).append(filename_path_classname)
     return result
 
+  """
+  Gets counts of all docs in each class in our corpus
+
+  Returns a dictionary of class counts
+  """
+  def get_class_counts(self):
+    return {class_name: len(fpcs) for class_name, fpcs in self.class_to_fpc.items()}
+
   """
   Gets a list of filenames classified as `class_name`
 
@@ -301,35 +426,17 @@ class DataPrepper():
   for the specified class_name
   """
   def get_texts_for_class(self, class_name, LIMIT=None):
-    result = []
-    for filename_path_classname in self.fpc:
-      if filename_path_classname[2] == class_name:
-        if LIMIT != None and len(result) > LIMIT:
-          break
-        else:
-          result.append(filename_path_classname)
-    return result
+    return self.class_to_fpc.get(class_name, [])[:LIMIT]
 
   """
-  Retrieves dictionary of training entries from self.fpc in the format:
-    {
-      'doc_name1' : ['some long string of this text...', class_name],
-      'doc_name2' : ['some long string of this text...', class_name],
-      ...
-    }
+  Reads and tokenizes the training docs in self.fpc across worker processes,
+  yielding in the order of self.fpc:
+    (doc_name, class_name, Counter({'token1': tf1, 'token2': tf2, ...}))
   """
-  def sample_texts(self):
-    result = {}
-
-    for fpc in self.fpc:
-      doc_name = fpc[0]
-      path_to_doc = fpc[1]
-      class_name = fpc[2]
-
-      f = open(path_to_doc, 'r', encoding='latin1')
-      result[doc_name] = [f.read(), class_name]
-
-    return result
+  def iter_docs(self):
+    with ProcessPoolExecutor(initializer=init_tokenizer_worker, initargs=(self.Tokenizer,)) as executor:
+      for doc in executor.map(read_and_count_terms, self.fpc, chunksize=64):
+        yield doc
 
   """
   Retrieves dictionary of test entries from self.fpc in the format:
@@ -346,16 +453,20 @@ class DataPrepper():
       doc_name = fpc[0]
       path_to_doc = fpc[1]
 
-      f = open(path_to_doc, 'r', encoding='latin1')
-      result[doc_name] = [f.read(), path_to_doc]
+      result[doc_name] = [read_text(path_to_doc), path_to_doc]
 
     return result
 
 
   """
-  Prints a progress bar
+  Prints a progress bar, redrawn only about once per 1% of progress and on
+  completion so that it stays cheap when called for every doc
   """
   def print_loading_bar(self, chunk, N, progress_text = '', complete_text = ''):
+    tick = max(1, N // 100)
+    if chunk % tick != 0 and chunk < N:
+      return
+
     percentage = (chunk / N) * 100
     percentage_int = int(percentage)
     percentage_decimal = str(percentage - percentage_int)[2]
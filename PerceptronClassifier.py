@@ -10,24 +10,27 @@ class PerceptronClassifier():
     print("[PerceptronClassifier] Instantiated!")
 
   """
-  Trains a weight vector using the perceptron learning algorithm
+  Trains a weight vector using the perceptron learning algorithm.
+  X is a sparse CSR matrix with one feature vector per row
   """
   def train(self, X, y_true, learning_rate=0.1, num_epochs=50):
-    N_dim = len(X[0])
-    N_samples = len(X)
+    N_samples, N_dim = X.shape
     w = np.ones(N_dim)
 
     for epoch in range(num_epochs):
       n_errors = 0 # accumulate number of errors in this epoch
 
       for i in range(N_samples):
-        x = X[i]
+        # Only the non-zero entries of row i contribute to the dot product
+        start, end = X.indptr[i], X.indptr[i + 1]
+        x_indices = X.indices[start:end]
+        x = X.data[start:end]
         y = y_true[i]
-        update = learning_rate * (y - self.classify(x, w, self.sigmoid_threshold_activation))
+        update = learning_rate * (y - self.classify(x, w[x_indices], self.sigmoid_threshold_activation))
         n_errors += int(update != 0.0)
 
         # Update weights
-        w += np.multiply(update, x)
+        w[x_indices] += np.multiply(update, x)
 
       if n_errors <= 1: # 1 is enough to stop
         break;
@@ -73,6 +76,10 @@ class PerceptronClassifier():
   #===========================================================================#
   # Classification Functions
   #===========================================================================#
+  """
+  Classifies every row of the sparse CSR matrix X with batch_classify and
+  returns the accuracy against y_true
+  """
   def batch_classify_with_acc(self, w, X, y_true, debug_mode=False):
     y_predict = self.batch_classify(w, X, debug_mode)
     print('y_true:', len(y_true), 'y_predict:', len(y_predict))
@@ -83,14 +90,20 @@ class PerceptronClassifier():
 
     return self.compute_acc(y_true, y_predict)
 
+  """
+  Classifies every row of the sparse CSR matrix X with the weight vector w,
+  scoring all rows with one sparse matrix-vector product
+  """
   def batch_classify(self, w, X, debug_mode=False):
+    scores = X.dot(w)
+
     y_predict = []
-    for x in X:
+    for i, score in enumerate(scores):
       if debug_mode:
-        print('x:', x)
-        print('weight:', w)
+        print('x:', X[i])
+        print('score:', score)
 
-      y_predict.append(self.classify(x, w, self.threshold_activation, debug_mode=False))
+      y_predict.append(self.threshold_activation(score))
 
       if debug_mode:
         print('---')
@@ -1,9 +1,14 @@
 # Import necessary modules
 import re
+import sys
 from porter import PorterStemmer
 
 PUNCTUATIONS = '!"#$%&\'()*+,-./:;<=>?@[\]^_`{|}~'
 
+# Compiled once at import rather than looked up in re's cache on every call
+NON_WORD_PATTERN = re.compile(r'\W+')
+MIXED_NUMERIC_PATTERN = re.compile(r'([0-9]+[!"#$%&\'()*+,-./:;<=>?@[\]^_`{|}~]*)+')
+
 #===========================================================================#
 # PREPARING THE DATASET FOR TEXT CLASSIFICATION
 # Executes the text normalization phase
@@ -22,12 +27,13 @@ class Tokenizer():
     STEM EVERY TOKEN
     REMOVE TOKEN IF IS STOP WORD
 
-  Returns list of text normalized tokens
+  Returns list of text normalized tokens, interned so that repeated tokens
+  share one string object and dict lookups on them can match by identity
   """
   def tokenize(self, input_str):
     result = []
     # input_str_list = input_str.split()
-    input_str_list = re.split('\W+', input_str)
+    input_str_list = NON_WORD_PATTERN.split(input_str)
 
     for token in input_str_list:
       result_tok = token.strip(PUNCTUATIONS)
@@ -36,7 +42,7 @@ class Tokenizer():
          not self.isMixedNumeric(result_tok):
 
         result_tok = self.stem(result_tok)
-        result.append(result_tok.lower())
+        result.append(sys.intern(result_tok.lower()))
 
     return result
 
@@ -76,8 +82,7 @@ class Tokenizer():
   A RegEx match object will be returned if a complete match occurs
   """
   def isMixedNumeric(self, input_str):
-    pattern = r'([0-9]+[!"#$%&\'()*+,-./:;<=>?@[\]^_`{|}~]*)+'
-    return re.match(pattern, input_str)
+    return MIXED_NUMERIC_PATTERN.match(input_str)
 
   #===========================================================================#
   # SETUP
@@ -2,6 +2,7 @@
 import sys
 import pickle
 import numpy as np
+from scipy.sparse import hstack
 from DataPrepper import DataPrepper
 from PerceptronClassifier import PerceptronClassifier
 
@@ -30,9 +31,8 @@ class TCTest():
 
     # Setup feature vectors for corpus
     feature_vectors_filepath = self.DataPrepper.run_test(self.df)
-    f_vectors = [x[0] for x in feature_vectors_filepath]
-    f_vectors = self.add_bias_to_f_vectors(f_vectors)
-    filepaths = [x[1] for x in feature_vectors_filepath]
+    f_vectors = self.add_bias_to_f_vectors(feature_vectors_filepath[0])
+    filepaths = feature_vectors_filepath[1]
 
     # CLASSIFICATION
     y_predict = self.classify(f_vectors)
@@ -40,25 +40,29 @@ class TCTest():
     self.output(filepaths, y_predict)
 
   def add_bias_to_f_vectors(self, f_vectors):
-    for f_vector in f_vectors:
-      # Insert bias term
-      f_vector.insert(0, 1.0)
-    return f_vectors
+    # Insert bias term as the first column
+    bias = np.ones((f_vectors.shape[0], 1), dtype=f_vectors.dtype)
+    return hstack([bias, f_vectors], format='csr')
 
   def classify(self, f_vectors):
+    # Score every doc against each model with one sparse matrix-vector product
+    model_scores = {}
+    for class_name in self.models.keys():
+      model_scores[class_name] = f_vectors.dot(self.models[class_name])
+
     y_predict = []
-    for f_vector in f_vectors:
-      y_predict.append(self.get_best_model(f_vector))
+    for i in range(f_vectors.shape[0]):
+      y_predict.append(self.get_best_model(model_scores, i))
     return y_predict
 
-  def get_best_model(self, f_vector):
+  def get_best_model(self, model_scores, doc_index):
     class_names = list(self.models.keys())
 
     score_so_far = 0
     best_class_so_far = class_names[0]
     scores = []
     for class_name in self.models.keys():
-      score = np.dot(self.models[class_name], f_vector)
+      score = model_scores[class_name][doc_index]
       scores.append([class_name, score])
       if score > score_so_far:
         score_so_far = score
@@ -99,16 +103,18 @@ class TCTest():
 #===========================================================================#
 # EXECUTING THE PROGRAM
 #===========================================================================#
-PATH_TO_STOP_WORDS = sys.argv[1]
-PATH_TO_MODEL = sys.argv[2]
-PATH_TO_TEST_LIST = sys.argv[3]
-PATH_TO_TEST_CLASS_LIST = sys.argv[4]
+# Guarded so that DataPrepper's worker processes can re-import this module
+if __name__ == '__main__':
+  PATH_TO_STOP_WORDS = sys.argv[1]
+  PATH_TO_MODEL = sys.argv[2]
+  PATH_TO_TEST_LIST = sys.argv[3]
+  PATH_TO_TEST_CLASS_LIST = sys.argv[4]
 
-print("PATH_TO_STOP_WORDS:", PATH_TO_STOP_WORDS,
-      ", PATH_TO_MODEL:", PATH_TO_MODEL,
-      ", PATH_TO_TEST_LIST", PATH_TO_TEST_LIST,
-      ", PATH_TO_TEST_CLASS_LIST", PATH_TO_TEST_CLASS_LIST)
+  print("PATH_TO_STOP_WORDS:", PATH_TO_STOP_WORDS,
+        ", PATH_TO_MODEL:", PATH_TO_MODEL,
+        ", PATH_TO_TEST_LIST", PATH_TO_TEST_LIST,
+        ", PATH_TO_TEST_CLASS_LIST", PATH_TO_TEST_CLASS_LIST)
 
-TCTest().test()
+  TCTest().test()
 
-print("=== FINISHED TESTING...RESULTS SAVED IN " + PATH_TO_TEST_CLASS_LIST + " ===")
+  print("=== FINISHED TESTING...RESULTS SAVED IN " + PATH_TO_TEST_CLASS_LIST + " ===")
@@ -1,6 +1,8 @@
 # Import standard modules
 import sys
 import pickle
+import numpy as np
+from scipy.sparse import hstack
 from DataPrepper import DataPrepper
 from PerceptronClassifier import PerceptronClassifier
 
@@ -30,14 +32,14 @@ class TextClassifier():
 
     # Setup feature vectors for corpus
     feature_vectors_classes_docfreq = self.DataPrepper.run()
-    feature_vectors_classes = feature_vectors_classes_docfreq[0]
-    self.insert_bias(feature_vectors_classes)
-    print('Dim of feature vector:', len(feature_vectors_classes[0][0]))
-    doc_freq_map = feature_vectors_classes_docfreq[1]
+    feature_vectors = self.insert_bias(feature_vectors_classes_docfreq[0])
+    feature_vector_classes = feature_vectors_classes_docfreq[1]
+    print('Dim of feature vector:', feature_vectors.shape[1])
+    doc_freq_map = feature_vectors_classes_docfreq[2]
 
     # For all classes in class_names, train a perceptron
     for class_name in class_names:
-      f_train_vectors = self.setup_feature_vectors(class_name, feature_vectors_classes)
+      f_train_vectors = self.setup_feature_vectors(class_name, feature_vectors, feature_vector_classes)
       X = f_train_vectors[0]
       y = f_train_vectors[1]
       w = self.PerceptronClassifier.train(X, y, learning_rate=0.02, num_epochs=15)
@@ -50,53 +52,50 @@ class TextClassifier():
     print("[TextClassifier] Saving model to disk...")
     pickle.dump(models_df, open(PATH_TO_MODEL, 'wb'))
 
-  def insert_bias(self, f_vectors_classnames):
-    for f_vector_classname in f_vectors_classnames:
-      f_vector_classname[0].insert(0, 1.0)
+  """
+  Prepends a bias column of 1.0s to the sparse feature vectors
+  """
+  def insert_bias(self, f_vectors):
+    bias = np.ones((f_vectors.shape[0], 1), dtype=f_vectors.dtype)
+    return hstack([bias, f_vectors], format='csr')
 
   """
-  Sets feature_vectors into the correct shape, with its true y classification
-  appended to the back of the feature vector's list
+  Pairs the feature_vectors with their true y classification for a perceptron
+  separating pos_class_name from all other classes
 
   Returns a tuple of X and y,
-    where X is of the format with length n_samples:
-    [[feature_vector_of_doc_1], [feature_vector_of_doc_2]...]
+    where X is the sparse CSR matrix of n_samples feature vectors, one per row
 
     where y is of the format with length n_samples, representing each feature
     vector's true classification:
     [1, 1, 0, ...]
   """
-  def setup_feature_vectors(self, pos_class_name, f_vectors_classnames):
-    result_f_vectors = []
+  def setup_feature_vectors(self, pos_class_name, f_vectors, f_vector_classnames):
     y = []
 
-    for f_vector_classname in f_vectors_classnames:
-      f_vector = f_vector_classname[0]
-      y_true = f_vector_classname[1]
-
-      # Separate the feature vector from its labelled class_name
-      result_f_vectors.append(f_vector)
-
+    for y_true in f_vector_classnames:
       # Re-mapping classnames to positive or negative classes
       if y_true == pos_class_name:
         y.append(1) # because positive
       else:
         y.append(-1) # because all other classes other than pos_class_name are negative
 
-    return [result_f_vectors, y]
+    return [f_vectors, y]
 
 #===========================================================================#
 # EXECUTING THE PROGRAM
 #===========================================================================#
-PATH_TO_STOP_WORDS = sys.argv[1]
-PATH_TO_TRAIN_CLASS_LIST = sys.argv[2]
-PATH_TO_MODEL = sys.argv[3]
+# Guarded so that DataPrepper's worker processes can re-import this module
+if __name__ == '__main__':
+  PATH_TO_STOP_WORDS = sys.argv[1]
+  PATH_TO_TRAIN_CLASS_LIST = sys.argv[2]
+  PATH_TO_MODEL = sys.argv[3]
 
-print("PATH_TO_STOP_WORDS:", PATH_TO_STOP_WORDS,
-      ", PATH_TO_TRAIN_CLASS_LIST:", PATH_TO_TRAIN_CLASS_LIST,
-      ", PATH_TO_MODEL", PATH_TO_MODEL)
+  print("PATH_TO_STOP_WORDS:", PATH_TO_STOP_WORDS,
+        ", PATH_TO_TRAIN_CLASS_LIST:", PATH_TO_TRAIN_CLASS_LIST,
+        ", PATH_TO_MODEL", PATH_TO_MODEL)
 
-TextClassifier().build()
+  TextClassifier().build()
 
-# pickle.dump(model, open(PATH_TO_MODEL, 'wb'))
-print("=== FINISHED TRAINING...MODEL SAVED IN " + PATH_TO_MODEL + " ===")
+  # pickle.dump(model, open(PATH_TO_MODEL, 'wb'))
+  print("=== FINISHED TRAINING...MODEL SAVED IN " + PATH_TO_MODEL + " ===")